@@ -1,10 +1,17 @@
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import requests
+import argparse
+import sys
+from calendar import monthrange
+from datetime import date
+import orjson
+import requests_cache
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin
-from itertools import count
-from time import sleep
-from terminaltables import SingleTable
+from itertools import repeat
+from math import ceil
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from environs import Env
 
 
@@ -12,6 +19,7 @@ HH_MOSCOW_AREA_ID = 1
 SJ_MOSCOW_AREA_ID = 4
 HH_API_URL = "https://api.hh.ru/"
 SJ_API_URL = "https://api.superjob.ru/2.0/"
+SJ_MAX_RESULTS = 500
 TOP_LANGUAGE_VACANCIES = [
     "JavaScript",
     "JAVA",
@@ -21,147 +29,242 @@ TOP_LANGUAGE_VACANCIES = [
     "C++",
     "C#",
 ]
+REQUEST_TIMEOUT = 10
+CACHE_NAME = str(Path(__file__).with_name("vacancies_cache"))
+CACHE_EXPIRE_AFTER = 3600
+MAX_CONCURRENT_PAGES = 5
+MAX_CONCURRENT_REQUESTS = 5
+
+
+def make_session():
+    """Create a requests session with pooled keep-alive connections, retries
+    on transient API errors and an on-disk cache of the responses.
+
+    Returns:
+    - requests_cache.CachedSession: A session to be reused for all calls to
+    one API.
+
+    At most MAX_CONCURRENT_REQUESTS requests to the API are sent at once, no
+    matter how many languages and pages are fetched in parallel, other threads
+    wait for a free connection. The responses are cached in an SQLite
+    database next to the script for CACHE_EXPIRE_AFTER seconds. The SuperJob
+    secret key header is left out of the cache keys and of the stored
+    requests.
+    """
+    session = requests_cache.CachedSession(
+        CACHE_NAME,
+        backend="sqlite",
+        expire_after=CACHE_EXPIRE_AFTER,
+        ignored_parameters=["X-Api-App-Id"],
+    )
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=MAX_CONCURRENT_REQUESTS,
+        pool_block=True,
+        max_retries=retries,
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+HH_SESSION = make_session()
+SJ_SESSION = make_session()
 
 
 def get_month_ago_date():
     """Get the date of the previous month in the format 'YYYY-MM-DD'."""
-    today = datetime.now()
-    month_ago = today - relativedelta(months=1)
-    return month_ago.strftime("%Y-%m-%d")
+    today = date.today()
+    year, month = divmod(today.year * 12 + today.month - 2, 12)
+    month += 1
+    day = min(today.day, monthrange(year, month)[1])
+    return date(year, month, day).strftime("%Y-%m-%d")
 
 
-def get_hh_vacancies(language):
+def fetch_page(session, url, params):
+    """Request a single page of vacancies from an API.
+
+    Parameters:
+    - session (requests_cache.CachedSession): The session of the API to
+    request.
+    - url (str): The URL of the vacancies endpoint.
+    - params (dict): The query parameters of the page.
+
+    Returns:
+    - dict: The decoded JSON payload of the page.
+    """
+    page_response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+    page_response.raise_for_status()
+    return orjson.loads(page_response.content)
+
+
+def get_hh_vacancies(language, date_from):
     """Retrieves a list of vacancies from HeadHunter API based on the provided
     language.
 
     Parameters:
     - language (str): The programming language to filter the
     vacancies by.
+    - date_from (str): The earliest publication date of the vacancies in
+    the format 'YYYY-MM-DD'.
 
     Returns:
     - list: A list of vacancy objects retrieved from the HeadHunter
     API.
+
+    The first page is requested alone to learn the total number of pages,
+    the rest of the pages are then requested concurrently.
     """
     vacancies_url = urljoin(HH_API_URL, "vacancies")
-    month_ago = get_month_ago_date()
-    vacancies = []
-    for page in count(0):
-        payload = {
-            "text": f"Программист {language}",
-            "area": HH_MOSCOW_AREA_ID,
-            "date_from": month_ago,
-            "only_with_salary": "true",
-            "page": page,
-        }
-        page_response = requests.get(vacancies_url, params=payload)
-        page_response.raise_for_status()
-
-        page_payload = page_response.json()
-        vacancies_found = page_payload["found"]
-        if page >= page_payload["pages"]:
-            break
-        if page == 5:
-            sleep(10)
-        vacancies.extend(page_payload["items"])
-    return vacancies, vacancies_found
 
+    payload = {
+        "text": f"Программист {language}",
+        "area": HH_MOSCOW_AREA_ID,
+        "date_from": date_from,
+        "only_with_salary": "true",
+        "per_page": 100,
+    }
+
+    def fetch_hh_page(page):
+        return fetch_page(HH_SESSION, vacancies_url, {**payload, "page": page})
 
-def get_sj_vacancies(secret_key, language):
-    """Retrieves a list of vacancies from SuperJob API based on the provided.
+    first_page_payload = fetch_hh_page(0)
+    vacancies = first_page_payload["items"]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGES) as executor:
+        pages = range(1, first_page_payload["pages"])
+        for page_payload in executor.map(fetch_hh_page, pages):
+            vacancies.extend(page_payload["items"])
+    return vacancies, first_page_payload["found"]
 
-    language and secret key.
+
+def get_sj_vacancies(language, date_from):
+    """Retrieves a list of vacancies from SuperJob API based on the provided
+    language.
 
     Parameters:
-    - secret_key (str): The secret key used to authenticate the API
-    request.
     - language (str): The programming language to filter the vacancies
     by.
+    - date_from (str): The earliest publication date of the vacancies in
+    the format 'YYYY-MM-DD'.
 
     Returns:
     - list: A list of vacancy objects retrieved from the SuperJob API.
 
     This function constructs the URL for the SuperJob API endpoint and makes a
     GET request to retrieve a list of vacancies. The request includes the
-    specified language, the secret key for authentication, and the date of the
-    previous month. The function iterates through the pages of the API response
-    and appends the vacancies to the list. If there are no more pages, the
-    function returns the list of vacancies.
+    specified language and the date to search from; the secret key for
+    authentication is set once on the SJ_SESSION headers. The first page is
+    requested alone, if SuperJob reports more vacancies, the rest of the pages
+    are requested concurrently in chunks of MAX_CONCURRENT_PAGES. Once a page
+    reports no more vacancies, the function returns the list of vacancies.
+    SuperJob serves only the first SJ_MAX_RESULTS vacancies of a search, so
+    no pages beyond them are requested.
     """
     vacancies_url = urljoin(SJ_API_URL, "vacancies")
-    month_ago = get_month_ago_date()
-    vacancies = []
-    headers = {"X-Api-App-Id": secret_key}
-    for page in count(0):
-        params = {
-            "town": "Москва",
-            "keywords": f"{language} разработчик",
-            "date_published_from": month_ago,
-            "page": page,
-            "count": 40,
-        }
-        page_response = requests.get(
-            vacancies_url, headers=headers, params=params
-        )
-        page_response.raise_for_status()
-        page_payload = page_response.json()
-        vacancies_found = page_payload["total"]
 
-        if page_payload["objects"]:
-            vacancies.extend(page_payload["objects"])
-        else:
-            return vacancies, vacancies_found
+    params = {
+        "town": "Москва",
+        "keywords": f"{language} разработчик",
+        "date_published_from": date_from,
+        "no_agreement": 1,
+        "count": 100,
+    }
+
+    def fetch_sj_page(page):
+        return fetch_page(SJ_SESSION, vacancies_url, {**params, "page": page})
+
+    first_page_payload = fetch_sj_page(0)
+    vacancies = first_page_payload["objects"]
+    vacancies_found = first_page_payload["total"]
+    more = first_page_payload["more"]
+    pages_count = ceil(
+        min(vacancies_found, SJ_MAX_RESULTS) / params["count"]
+    )
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGES) as executor:
+        for first_page in range(1, pages_count, MAX_CONCURRENT_PAGES):
+            if not more:
+                break
+            pages = range(
+                first_page, min(first_page + MAX_CONCURRENT_PAGES, pages_count)
+            )
+            for page_payload in executor.map(fetch_sj_page, pages):
+                vacancies.extend(page_payload["objects"])
+                more = page_payload["more"]
+                if not more:
+                    break
+    return vacancies, vacancies_found
 
 
-def gather_languages_statistics_hh(languages):
+def gather_languages_statistics_hh(languages, date_from):
     """Calculate statistics for HeadHunter vacancies based on the provided
     languages.
 
     Parameters:
     - languages (list): A list of programming languages to gather
     statistics for.
+    - date_from (str): The earliest publication date of the vacancies in
+    the format 'YYYY-MM-DD'.
 
     Returns:
     - dict: A dictionary containing statistics for each language
     including the number of vacancies found, processed, and the average salary.
+
+    The vacancies of all the languages are retrieved concurrently.
     """
     language_statistic = {}
-    for language in languages:
-        hh_vacancies, vacancies_found = get_hh_vacancies(language)
+    with ThreadPoolExecutor(max_workers=max(1, len(languages))) as executor:
+        languages_vacancies = list(
+            executor.map(get_hh_vacancies, languages, repeat(date_from))
+        )
+    for language, (hh_vacancies, vacancies_found) in zip(
+        languages, languages_vacancies
+    ):
         if hh_vacancies:
-            count_language_vacancies = vacancies_found
             avarage_salary, salary_count = get_average_salary(
                 hh_vacancies, predict_rub_salary_hh
             )
             language_statistic[language] = {
-                "vacancies_found": count_language_vacancies,
+                "vacancies_found": vacancies_found,
                 "vacancies_processed": salary_count,
                 "average_salary": avarage_salary,
             }
     return language_statistic
 
 
-def gather_languages_statistics_sj(languages, secret_key):
+def gather_languages_statistics_sj(languages, date_from):
     """Calculate statistics for SuperJob vacancies based on the provided
     languages.
 
     Parameters:
     - languages (list): A list of programming languages to gather
     statistics for.
+    - date_from (str): The earliest publication date of the vacancies in
+    the format 'YYYY-MM-DD'.
 
     Returns:
     - dict: A dictionary containing statistics for each language
     including the number of vacancies found, processed, and the average salary.
+
+    The vacancies of all the languages are retrieved concurrently.
     """
     language_statistic = {}
-    for language in languages:
-        sj_vacancies, vacancies_found = get_sj_vacancies(secret_key, language)
+    with ThreadPoolExecutor(max_workers=max(1, len(languages))) as executor:
+        languages_vacancies = list(
+            executor.map(get_sj_vacancies, languages, repeat(date_from))
+        )
+    for language, (sj_vacancies, vacancies_found) in zip(
+        languages, languages_vacancies
+    ):
         if sj_vacancies:
-            count_language_vacancies = vacancies_found
             avarage_salary, salary_count = get_average_salary(
                 sj_vacancies, predict_rub_salary_sj
             )
             language_statistic[language] = {
-                "vacancies_found": count_language_vacancies,
+                "vacancies_found": vacancies_found,
                 "vacancies_processed": salary_count,
                 "average_salary": avarage_salary,
             }
@@ -231,34 +334,28 @@ def get_average_salary(all_vacancies, predict_rub_salary_for_site):
     site.
 
     Parameters:
-    - all_vacancies (list): A list of vacancy dictionaries. 
-    - site (str): The name of the site for which the average salary is
-    calculated.
+    - all_vacancies (list): A list of vacancy dictionaries.
+    - predict_rub_salary_for_site (function): The function predicting the
+    salary of a vacancy of the site in Russian Rubles.
 
     Returns:
     - avarage_salary (int): The average salary calculated from the
     vacancies.
     - vacancy_count (int): The number of vacancies processed.
 
-    This function iterates over the list of vacancies and calculates the
-    average salary. It checks the site parameter to determine which prediction
-    function to use for calculating the salary. If the prediction function
-    returns a value, it increments the vacancy_count and adds the salary to the
-    total. If the prediction function returns None, it adds 0 to the
-    average_salary. Finally, it calculates the average_salary by dividing the
-    total salary by the vacancy_count. The function returns the average_salary
-    and the vacancy_count as a tuple.
+    This function predicts the salary of every vacancy and skips the
+    vacancies the prediction function returns None for. The average_salary is
+    calculated by dividing the total of the predicted salaries by their
+    count. The function returns the average_salary and the vacancy_count as a
+    tuple.
     """
-    total_salary = 0
-    vacancy_count = 0
-    avarage_salary = 0
-    for vacancy in all_vacancies:
-        predict_rub_salary = predict_rub_salary_for_site(vacancy)
-        if predict_rub_salary:
-            vacancy_count += 1
-            total_salary += predict_rub_salary
-        if vacancy_count:
-            avarage_salary = total_salary / vacancy_count
+    salaries = [
+        salary
+        for salary in map(predict_rub_salary_for_site, all_vacancies)
+        if salary
+    ]
+    vacancy_count = len(salaries)
+    avarage_salary = sum(salaries) / vacancy_count if vacancy_count else 0
     return int(avarage_salary), vacancy_count
 
 
@@ -271,51 +368,81 @@ def make_vacancies_table(vacancies_statistic, site):
 
     Returns: - str: A formatted table representing the vacancies statistic for
     the given site.
+
+    The table is rendered as simplified plain text: the title on its own line
+    followed by the rows separated by ASCII '-+-' lines, without an outer
+    frame.
     """
     title = f"Статистика поиска вакансий на {site}"
     table_data = [
-        [
+        (
             "Язык программирования",
             "Вакансий найдено",
             "Вакансий обработано",
             "Средняя зарплата",
-        ]
-    ]
-    for language_name, statistic in vacancies_statistic.items():
-        table_data.append(
-            [
+        ),
+        *(
+            (
                 language_name,
-                statistic["vacancies_found"],
-                statistic["vacancies_processed"],
-                statistic["average_salary"],
-            ]
-        )
+                str(statistic["vacancies_found"]),
+                str(statistic["vacancies_processed"]),
+                str(statistic["average_salary"]),
+            )
+            for language_name, statistic in vacancies_statistic.items()
+        ),
+    ]
 
-    table_instance = SingleTable(table_data, title)
-    table_instance.inner_heading_row_border = False
-    table_instance.inner_row_border = True
-    table_instance.justify_columns = {0: "center", 1: "center", 2: "center"}
-    return table_instance.table
+    columns_widths = [max(map(len, column)) for column in zip(*table_data)]
+    justify_columns = (str.center, str.center, str.center, str.ljust)
+    rows = [
+        " | ".join(
+            justify(cell, width)
+            for justify, cell, width in zip(
+                justify_columns, row, columns_widths
+            )
+        ).rstrip()
+        for row in table_data
+    ]
+    separator = "-+-".join("-" * width for width in columns_widths)
+    return "\n".join([title, separator, f"\n{separator}\n".join(rows)])
 
 
 def main():
-    env = Env()
-    env.read_env()
-    sj_secret_key = env.str("SJ_SECRET_KEY")
-    print(
-        make_vacancies_table(
-            gather_languages_statistics_hh(TOP_LANGUAGE_VACANCIES), "HH"
-        )
+    parser = argparse.ArgumentParser(
+        description="Статистика вакансий программистов на HH и SuperJob"
     )
-    print()
-    print(
-        make_vacancies_table(
-            gather_languages_statistics_sj(
-                TOP_LANGUAGE_VACANCIES, sj_secret_key
-            ),
-            "SuperJob",
-        )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="использовать только закэшированные ответы API",
     )
+    args = parser.parse_args()
+    if args.offline:
+        for session in (HH_SESSION, SJ_SESSION):
+            session.settings.only_if_cached = True
+            session.settings.stale_if_error = True
+    else:
+        env = Env()
+        env.read_env()
+        SJ_SESSION.headers["X-Api-App-Id"] = env.str("SJ_SECRET_KEY")
+    month_ago = get_month_ago_date()
+    try:
+        hh_statistic = gather_languages_statistics_hh(
+            TOP_LANGUAGE_VACANCIES, month_ago
+        )
+        sj_statistic = gather_languages_statistics_sj(
+            TOP_LANGUAGE_VACANCIES, month_ago
+        )
+    except HTTPError as error:
+        if args.offline and error.response.status_code == 504:
+            sys.exit(
+                "В кэше нет ответов API за сегодня, "
+                "запустите скрипт без --offline"
+            )
+        raise
+    print(make_vacancies_table(hh_statistic, "HH"))
+    print()
+    print(make_vacancies_table(sj_statistic, "SuperJob"))
 
 
 if __name__ == "__main__":